@@ -1,9 +1,12 @@
-import math
 import cv2
 import numpy as np
 import serial_interface
 import sys
 import getopt
+try:
+    from numba import njit     # optional, speeds up coordinate math
+except ImportError:
+    njit = None
 
 
 # layout constants
@@ -15,6 +18,7 @@ BLIP_SIZE = 2                   # object size in pixels
 CIRCLES = 4                     # number of circles on radar reticule
 RADIAL_LINES = 6                # number of radial lines on reticule
 TRAIL_LENGTH = 10               # number of scan lines to trail
+LINE_LEVELS = 16                # brightness levels of lines in front of and behind objects
 LINE_FADE_FACTOR = 0.80         # fade per scan line trail
 BLIP_FADE_FACTOR = 0.994        # how much objects fade with distance from scan line
 BLIP_COLOR = (0, 77, 255)       # color of blip
@@ -23,6 +27,29 @@ SCAN_LINE_COLOR = (0, 77, 255)  # color of scan line
 TEXT_COLOR = (0, 22, 200)       # color text on screen
 DRAW_POSTERIOR_LINE = True      # draw line behind object
 DRAW_ANTERIOR_LINE = True       # draw line in front of object
+FRAME_TIMEOUT = 0.033           # max time to wait for new serial data before handling GUI events (s)
+
+# trig lookup tables indexed by integer degrees
+# (full circle so trail angles that run past 0 or 180 degrees stay valid)
+SIN = np.sin(np.deg2rad(np.arange(360)))
+COS = np.cos(np.deg2rad(np.arange(360)))
+BLIP_ANGLES = np.arange(181)        # angle of every blip
+TRAIL_STEPS = np.arange(TRAIL_LENGTH)   # angle offsets of scan line trail
+
+# scan line trail colors (each trail line fades by LINE_FADE_FACTOR)
+TRAIL_COLORS = np.array(SCAN_LINE_COLOR) * LINE_FADE_FACTOR ** np.arange(TRAIL_LENGTH)[:, None]
+TRAIL_COLORS = [tuple(c) for c in TRAIL_COLORS.tolist()]
+
+# colors of lines behind (posterior) and in front of (anterior) objects per brightness level
+POSTERIOR_COLORS = np.array(BLIP_COLOR) * np.arange(LINE_LEVELS)[:, None] / (LINE_LEVELS - 1)
+ANTERIOR_COLORS = [tuple(c) for c in POSTERIOR_COLORS[:, [0, 2, 1]].tolist()]
+POSTERIOR_COLORS = [tuple(c) for c in POSTERIOR_COLORS.tolist()]
+
+# blip colors are stored in 8.8 fixed point and faded with a 0.16 fixed point multiply
+BLIP_COLOR_FIXED = np.array(BLIP_COLOR, np.uint16) << 8
+BLIP_FADE_FIXED = round(BLIP_FADE_FACTOR * (1 << 16))
+BLIP_LEVEL_CHANNEL = int(np.argmax(BLIP_COLOR))     # channel used to find brightness level of a blip
+BLIP_LEVEL_FULL = int(BLIP_COLOR_FIXED[BLIP_LEVEL_CHANNEL])     # that channel of a fresh blip
 
 # debugging options (persistent)
 DEBUG_DATA = False      # create fake data or use real serial data
@@ -36,13 +63,15 @@ draw_anterior_line = DRAW_ANTERIOR_LINE
 draw_posterior_line = DRAW_POSTERIOR_LINE
 com_port = 'COM10'  # default com port
 baud_rate = 115200  # default baud rate
+use_cuda = False    # compute blip coordinates on a CUDA device
+use_opencl = False  # keep frame buffers on an OpenCL device
 min_rand = max_range/2      # min for random number generator (used only if generating debug data)
 max_rand = min_rand*1.25    # max for random number generator
 
 # get options from command line
 try:
     opts, args = getopt.getopt(sys.argv[1:], 'hvr:fb', ['com=', 'baud=', 'help', 'range=',
-                                                        'debug', 'min_rand=', 'max_rand='])
+                                                        'debug', 'min_rand=', 'max_rand=', 'cuda', 'opencl'])
 except getopt.GetoptError as e:
     print(e)
     opts = [('-h', '')]
@@ -60,6 +89,10 @@ for opt, arg in opts:
   --com <com>\t: sets COM port (e.g COM9, COM10...), default = {com_port}
   --baud <baud>\t: sets baud rate (e.g. 9600), default = {baud_rate}
   
+  GPU options:
+  --cuda\t: computes blip coordinates on a CUDA device (needs OpenCV built with CUDA)
+  --opencl\t: keeps frame buffers on an OpenCL device (e.g. integrated GPU)
+  
   Debug options:
   --debug\t  : displays random data instead of using serial
   --min_rand <cm> : minimum value for random number generator, default = {min_rand}cm
@@ -77,6 +110,10 @@ for opt, arg in opts:
         com_port = arg
     elif opt == '--baud':
         baud_rate = arg
+    elif opt == '--cuda':
+        use_cuda = True
+    elif opt == '--opencl':
+        use_opencl = True
     elif opt == '--debug':
         debug_data = True
     elif opt == '--min_rand':
@@ -87,6 +124,7 @@ for opt, arg in opts:
 # initialize serial if not debugging
 if not debug_data:
     serial_interface.init_serial(com_port, baud_rate)
+    serial_interface.start_reader_thread()
     wait = 1    # wait time for OpenCV GUI
 else:
     wait = 25
@@ -105,6 +143,23 @@ for i in range(CIRCLES):
     scale = (1 - i/CIRCLES)
     radii[i] = int((x_center - X_PADDING) * scale)
     cv2.circle(img, (x_center, y_bottom), radii[i], CIRCLE_COLOR, 1, cv2.LINE_AA)
+px_per_cm = radii[0] / max_range    # display scale (pixels per cm)
+trail_radii = np.full(TRAIL_LENGTH, radii[0], np.float64)  # scan lines span the whole radar
+
+# set up GPU buffers for blip coordinates (angles are uploaded once)
+if use_cuda:
+    if hasattr(cv2, 'cuda') and cv2.cuda.getCudaEnabledDeviceCount() > 0:
+        cuda_stream = cv2.cuda_Stream()
+        cuda_angles = cv2.cuda_GpuMat()
+        cuda_angles.upload(np.arange(181, dtype=np.float32).reshape(1, -1))
+        cuda_magnitudes = cv2.cuda_GpuMat(1, 181, cv2.CV_32FC1)
+        cuda_x = cv2.cuda_GpuMat(1, 181, cv2.CV_32FC1)
+        cuda_y = cv2.cuda_GpuMat(1, 181, cv2.CV_32FC1)
+        cuda_x_host = np.empty((1, 181), np.float32)
+        cuda_y_host = np.empty((1, 181), np.float32)
+    else:
+        print('No CUDA device available - computing blip coordinates on CPU')
+        use_cuda = False
 
 # draw distance labels
 cv2.rectangle(img, (0, int(y_bottom + Y_PADDING * 0.1)), (img.shape[1], img.shape[0]), (0, 0, 0), cv2.FILLED)
@@ -121,16 +176,15 @@ if RADIAL_LINES > 0:
     for i in range(RADIAL_LINES+1):
         angle_scale = (1 - i / RADIAL_LINES)
         line_angle = round(angle_scale * 180)
-        line_angle_rad = line_angle * math.pi/180
         m = 25*angle_scale
-        x_label = int(x_center - m + (radii[0] + 10) * math.cos(line_angle_rad))  # x point of radar line
-        y_label = int(y_bottom - (radii[0] + 10) * math.sin(line_angle_rad))  # y point of radar line
+        x_label = int(x_center - m + (radii[0] + 10) * COS[line_angle])  # x point of radar line
+        y_label = int(y_bottom - (radii[0] + 10) * SIN[line_angle])  # y point of radar line
         label = str(round(line_angle))
         cv2.putText(img, label, (x_label, y_label), font, 0.5, TEXT_COLOR, 1, cv2.LINE_AA)
 
 
 # data acquisition
-def get_data():
+def get_data(timeout=0):
     if debug_data:
         # fake data generator
         global i_val
@@ -142,31 +196,71 @@ def get_data():
         i_val = i_val + 1   # increment
         # generate random distance
         dist = np.random.randint(min_rand, max_rand)
+        samples = [(deg, dist)]
     else:
-        # get data from serial interface
-        deg, dist = serial_interface.get_serial_data()
+        # get every sample received by serial interface since last call (waits up to timeout for first one)
+        samples = []
+        sample = serial_interface.get_serial_data(timeout)
+        while sample is not None:
+            samples.append(sample)
+            sample = serial_interface.get_serial_data()
 
     if serial_output:
-        print(f'degrees={deg}\t distance={dist}')
-    return deg, dist
-
-
-def draw_scan_line(image, angle, l_color, x_start=x_center, y_start=y_bottom, x_end=None, y_end=None):
-    angle = angle * math.pi/180                         # convert angle to radians
-    if x_end is None:
-        x_end = int(x_center + radii[0] * math.cos(angle))  # x point of radar line
-    if y_end is None:
-        y_end = int(y_bottom - radii[0] * math.sin(angle))  # y point of radar line
-    cv2.line(image, (x_start, y_start), (x_end, y_end), l_color, 1, cv2.LINE_AA)
-
-
-def draw_blip(angle, dist, b_color):
-    angle = angle * math.pi / 180                       # convert to radians
-    dist = dist * (radii[0]/max_range)                  # convert cm to pixels
-    x_object = int(x_center + dist * math.cos(angle))   # x coordinate of object
-    y_object = int(y_bottom - dist * math.sin(angle))   # y coordinate of object
-    cv2.circle(frame, (x_object, y_object), BLIP_SIZE, b_color, cv2.FILLED, cv2.LINE_AA)
-    return x_object, y_object
+        for deg, dist in samples:
+            print(f'degrees={deg}\t distance={dist}')
+    return samples
+
+
+def draw_scan_line(image, angle, l_color):
+    x_end = int(x_center + radii[0] * COS[angle])   # x point of radar line
+    y_end = int(y_bottom - radii[0] * SIN[angle])   # y point of radar line
+    cv2.line(image, (x_center, y_bottom), (x_end, y_end), l_color, 1, cv2.LINE_AA)
+
+
+# convert integer degree angles and distances (pixels) into screen coordinates, written to out (n, 2)
+def polar_coords(angles, dists, sin_t, cos_t, x0, y0, out):
+    angles = angles % 360
+    out[:, 0] = x0 + dists * cos_t[angles]
+    out[:, 1] = y0 - dists * sin_t[angles]
+    return out
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def polar_coords(angles, dists, sin_t, cos_t, x0, y0, out):
+        for k in range(angles.size):
+            a = angles[k] % 360
+            out[k, 0] = np.int32(x0 + dists[k] * cos_t[a])
+            out[k, 1] = np.int32(y0 - dists[k] * sin_t[a])
+        return out
+
+
+# screen coordinates of every blip
+def blip_coords():
+    np.multiply(blip_dist, px_per_cm, out=blip_px)  # convert cm to pixels
+    if use_cuda:
+        cuda_magnitudes.upload(blip_px.reshape(1, -1), cuda_stream)
+        cv2.cuda.polarToCart(cuda_magnitudes, cuda_angles, cuda_x, cuda_y, True, cuda_stream)
+        cuda_stream.waitForCompletion()
+        cuda_x.download(cuda_x_host)
+        cuda_y.download(cuda_y_host)
+        blip_xy[:, 0] = x_center + cuda_x_host.ravel()
+        blip_xy[:, 1] = y_bottom - cuda_y_host.ravel()
+        return blip_xy
+    return polar_coords(BLIP_ANGLES, blip_px, SIN, COS, x_center, y_bottom, blip_xy)
+
+
+# draw line segments from starts to ends, with one cv2.polylines call per brightness level
+# (faintest level first, so the freshest lines end up on top)
+def draw_segments(image, starts, ends, levels, level_colors):
+    segments = np.empty((len(ends), 2, 2), np.int32)
+    segments[:, 0] = starts
+    segments[:, 1] = ends
+    counts = np.bincount(levels, minlength=len(level_colors))
+    groups = np.split(segments[np.argsort(levels, kind='stable')], np.cumsum(counts)[:-1])
+    for color, group in zip(level_colors, groups):
+        if len(group) > 0:
+            cv2.polylines(image, group, False, color, 1, cv2.LINE_AA)
 
 
 def draw_radial_lines(image, num_lines):
@@ -177,66 +271,107 @@ def draw_radial_lines(image, num_lines):
             draw_scan_line(image, r_line_angle, CIRCLE_COLOR)
 
 
-# to store blip positions and colors [distance][color]
-blips = [[0, (0, 0, 0)] for i in range(181)]
+# radial lines are static so draw them once on the reticule background
+draw_radial_lines(img, RADIAL_LINES)
+
+# to store blip distances and colors, one entry per degree
+blip_dist = np.zeros(181, np.float32)
+blip_color = np.zeros((181, 3), np.uint16)   # 8.8 fixed point
 last_degrees = -1            # last degrees to determine direction of scan
 
+# reusable frame buffer and mask of the radar area that changes between frames
+frame = img.copy()
+dirty_mask = np.zeros_like(img[:, :, 0])
+cv2.circle(dirty_mask, (x_center, y_bottom), radii[0] + 10, 255, cv2.FILLED)
+overdraw = False             # objects were drawn outside of the radar area in the last frame
+
+# move frame buffers to OpenCL device (OpenCV transparent API)
+if use_opencl:
+    if cv2.ocl.haveOpenCL():
+        cv2.ocl.setUseOpenCL(True)
+        img = cv2.UMat(img)
+        dirty_mask = cv2.UMat(dirty_mask)
+        frame = cv2.UMat(frame)
+    else:
+        print('No OpenCL device available - using CPU frame buffers')
+        use_opencl = False
+
+# reusable buffers for per frame calculations
+blip_px = np.empty(181, np.float32)                 # blip distances in pixels
+blip_xy = np.empty((181, 2), np.int32)              # blip screen coordinates
+blip_fade = np.empty((181, 3), np.uint32)           # blip colors while fading
+blip_draw_color = np.empty((181, 3), np.uint16)     # 8 bit blip colors
+blip_level = np.empty(181, np.uint32)               # brightness levels of blip lines
+trail_angles = np.empty(TRAIL_LENGTH, np.int64)     # scan line angles
+trail_xy = np.empty((TRAIL_LENGTH, 2), np.int32)    # scan line end points
+
+# end points of lines behind objects (edge of radar)
+center = (x_center, y_bottom)
+edge_xy = polar_coords(BLIP_ANGLES, np.full(181, radii[0], np.float64), SIN, COS, x_center, y_bottom,
+                       np.empty((181, 2), np.int32))
+
 # display graph with updates
+cv2.imshow("LIDAR Display", frame)     # empty radar until data arrives
 while True:
-    # get data
-    degrees, distance = get_data()     # get data from serial function
-    radians = degrees * math.pi/180     # convert degrees to radians
-
-    frame = img.copy()  # create current frame
-
-    # draw scan line and trail
-    direction = degrees - last_degrees  # 1 = up; -1 = down
-    line_color = SCAN_LINE_COLOR
-    for j in range(TRAIL_LENGTH):
-        angle_deg = degrees - direction * j                             # calculate scan line angle
-        draw_scan_line(frame, angle_deg, line_color)                    # draw scan line
-        line_color = tuple(LINE_FADE_FACTOR * c for c in line_color)    # fade line color
-
-    # draw radial lines on reticule
-    draw_radial_lines(frame, RADIAL_LINES)
-
-    # update objects array with current object data
-    # color is refreshed every time object distance is updated
-    current = int(degrees)
-    blips[current][0] = distance      # set distance
-    blips[current][1] = BLIP_COLOR    # refresh color
-
-    # draw objects
-    for j in range(len(blips)):
-        # get distance and color
-        distance = blips[j][0]
-        color = blips[j][1]
-
-        # draw blip on screen
-        x, y = draw_blip(j, distance, color)
-
-        # draw line behind object
+    # apply every sample received since the last frame, only redraw if there is new data
+    samples = get_data(FRAME_TIMEOUT)
+    if samples:
+        for degrees, distance in samples:
+            direction = (degrees > last_degrees) - (degrees < last_degrees)     # sign of scan step
+            last_degrees = degrees
+
+            # fade colors of objects each time new data arrives
+            # this will fade object blips as their data gets more stale
+            np.multiply(blip_color, BLIP_FADE_FIXED, out=blip_fade, dtype=np.uint32)
+            np.right_shift(blip_fade, 16, out=blip_fade)
+            blip_color[:] = blip_fade
+
+            # update objects array with current object data
+            # color is refreshed every time object distance is updated
+            current = int(degrees)
+            blip_dist[current] = distance       # set distance
+            blip_color[current] = BLIP_COLOR_FIXED  # refresh color
+
+        # restore background of current frame (whole frame if objects were drawn outside the radar area)
+        cv2.copyTo(img, None if overdraw else dirty_mask, frame)
+
+        # draw scan line and trail
+        np.multiply(TRAIL_STEPS, -direction, out=trail_angles)     # calculate scan line angles
+        trail_angles += degrees
+        polar_coords(trail_angles, trail_radii, SIN, COS, x_center, y_bottom, trail_xy)
+        for j, (x, y) in enumerate(trail_xy.tolist()):
+            cv2.line(frame, center, (x, y), TRAIL_COLORS[j], 1, cv2.LINE_AA)
+
+        # convert every blip to screen coordinates at once
+        blip_coords()
+        colors = blip_draw_color
+        np.add(blip_color, 128, out=colors)     # round to 8 bit colors
+        np.right_shift(colors, 8, out=colors)
+        # quantize blip lines into brightness levels
+        np.multiply(blip_color[:, BLIP_LEVEL_CHANNEL], LINE_LEVELS - 1, out=blip_level, dtype=np.uint32)
+        blip_level += BLIP_LEVEL_FULL // 2
+        blip_level //= BLIP_LEVEL_FULL
+
+        # draw line behind objects that are within range
+        if draw_posterior_line:
+            in_range = np.nonzero(blip_dist < max_range)[0]
+            draw_segments(frame, blip_xy[in_range], edge_xy[in_range], blip_level[in_range], POSTERIOR_COLORS)
+
+        # draw line in front of objects
         if draw_anterior_line:
-            c_front = (color[0], color[2], color[1])
-            # if distance > max_range:
-            #     draw_scan_line(frame, j, c_front)
-            # else:
-            draw_scan_line(frame, j, c_front, x_end=x, y_end=y)
-        if draw_posterior_line & (distance < max_range):
-            draw_scan_line(frame, j, color, x_start=x, y_start=y)
-
-        # fade color after object has been accessed (each time it has been accessed)
-        # this will fade object blips as their data gets more stale
-        blips[j][1] = tuple(BLIP_FADE_FACTOR * c for c in color)
-
-    # show frame
-    cv2.imshow("LIDAR Display", frame)
+            draw_segments(frame, center, blip_xy, blip_level, ANTERIOR_COLORS)
+
+        # draw objects
+        colors = [tuple(c) for c in colors.tolist()]
+        for j, (x, y) in enumerate(blip_xy.tolist()):
+            cv2.circle(frame, (x, y), BLIP_SIZE, colors[j], cv2.FILLED, cv2.LINE_AA)
+        overdraw = not (np.abs(blip_dist) <= max_range).all()   # also catches nan/inf distances
+
+        # show frame
+        cv2.imshow("LIDAR Display", frame)
     if cv2.waitKey(wait) in (ord('q'), 0x1b):
         break
 
-    # update last degree
-    last_degrees = degrees
-
 # close serial if not debugging
 if not debug_data:
     serial_interface.close()
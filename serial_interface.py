@@ -1,7 +1,14 @@
 import serial
 import sys
+import threading
+import queue
+
+TIMEOUT = 1.0   # seconds to wait for a complete line
 
 ser = None
+partial = b''               # start of a line cut off by a read timeout
+reader = None               # background thread reading from serial
+samples = queue.Queue()     # samples read by the reader thread, oldest first
 
 
 def init_serial(port, baudrate):
@@ -12,6 +19,7 @@ def init_serial(port, baudrate):
     # configure serial port
     ser.port = port
     ser.baudrate = baudrate
+    ser.timeout = TIMEOUT
 
     # open serial port
     try:
@@ -21,29 +29,54 @@ def init_serial(port, baudrate):
         sys.exit(1)
 
 
-def get_serial_data():
-    global ser
-    if ser is not None:
-        # get data from serial
+def start_reader_thread():
+    global reader
+    # read serial in the background so waiting on data never blocks the caller
+    if ser is not None and reader is None:
+        reader = threading.Thread(target=read_loop, daemon=True)
+        reader.start()
+
+
+def read_loop():
+    while ser is not None and ser.is_open:
         try:
-            line = ser.readline().decode('utf-8')
-        except UnicodeDecodeError:
-            print('Unicode decoding error - waiting for next line')
-            line = '0,0.0\r\n'
+            sample = read_sample()
+        except (serial.serialutil.SerialException, OSError) as e:
+            if ser.is_open:
+                print(e)    # serial port failed (e.g. device unplugged)
+            break           # otherwise port was closed by close()
+        if sample is not None:
+            samples.put(sample)
 
-        # process serial data
-        degrees, distance = line.strip().split(',')
-        distance = float(distance)                      # convert distance string to float
-        degrees = int(degrees)
-    else:
-        degrees = 0
-        distance = 0
 
-    return degrees, distance
+def read_sample():
+    global ser, partial
+    # get data from serial ("deg,dist\r\n" in ASCII)
+    line = partial + ser.readline()
+    if not line.endswith(b'\n'):
+        partial = line  # timed out, keep what arrived so far for the next read
+        return None
+    partial = b''
+
+    # process serial data (int and float parse bytes directly)
+    try:
+        degrees, distance = line.split(b',', 1)
+        return int(degrees), float(distance)
+    except ValueError:
+        print('Invalid serial data - waiting for next line')
+        return None
+
+
+def get_serial_data(timeout=0):
+    # returns next sample read by the reader thread, or None if there is no new sample
+    # waits up to timeout seconds for a sample to arrive
+    try:
+        return samples.get(timeout=timeout) if timeout > 0 else samples.get_nowait()
+    except queue.Empty:
+        return None
 
 
 def close():
     global ser
     if ser is not None:
         ser.close()
-